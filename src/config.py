@@ -22,6 +22,10 @@ MAX_CASH_REGISTERS_PER_STORE = 4
 RECEIPTS_PER_CASH_PER_DAY = 50
 ITEMS_PER_RECEIPT_MIN = 1
 ITEMS_PER_RECEIPT_MAX = 10
+# Формат файлов генератора: parquet или csv
+FILE_FORMAT = os.getenv('FILE_FORMAT', 'parquet')
+# Расширения файлов, которые принимает загрузчик
+DATA_FILE_EXTENSIONS = ('.csv', '.parquet')
 
 # Настройки БД из .env
 DB_CONFIG = {
@@ -35,6 +39,17 @@ DB_CONFIG = {
 # Настройки загрузки
 BATCH_SIZE = int(os.getenv('BATCH_SIZE', 1000))
 MAX_RETRIES = int(os.getenv('MAX_RETRIES', 3))
+# Количество процессов для параллельного разбора файлов загрузчиком.
+# По умолчанию 1: файлы небольшие, и запуск пула (на Windows - с повторным
+# импортом pandas/pyarrow в каждом процессе) дороже их разбора
+LOAD_WORKERS = max(1, int(os.getenv('LOAD_WORKERS', 1)))
+# Способ вставки: copy (COPY FROM STDIN) или values (execute_values пачками по BATCH_SIZE)
+INSERT_METHODS = ('copy', 'values')
+INSERT_METHOD = os.getenv('INSERT_METHOD', 'copy')
+if INSERT_METHOD not in INSERT_METHODS:
+    raise ValueError(
+        f"Неверное значение INSERT_METHOD: '{INSERT_METHOD}' (допустимо: {', '.join(INSERT_METHODS)})"
+    )
 
 # Категории товаров
 CATEGORIES = [
@@ -1,29 +1,64 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta
 import random
 import string
-from config import DATA_DIR, NUM_STORES, CATEGORIES, PRODUCTS_BY_CATEGORY
+from config import DATA_DIR, NUM_STORES, FILE_FORMAT, CATEGORIES, PRODUCTS_BY_CATEGORY
 from config import DISCOUNT_PROBABILITY, DISCOUNT_RANGE, GENERATION_SETTINGS
 import config as config
 import logging
-import sys
 import argparse
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/generator.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from log_utils import setup_logging
+
 logger = logging.getLogger(__name__)
 
+# Структуры каталога, подготовленные один раз при импорте
+_CATEGORIES_TUP = tuple(CATEGORIES)
+_PRODUCTS_BY_CATEGORY_TUP = {
+    category: tuple(PRODUCTS_BY_CATEGORY[category]) for category in _CATEGORIES_TUP
+}
+_DOC_ID_ALPHABET = string.ascii_uppercase + string.digits
+_DOC_ID_ALPHABET_CODES = np.frombuffer(_DOC_ID_ALPHABET.encode('ascii'), dtype=np.uint8)
+
+# Плоские массивы каталога для векторной генерации
+_CATEGORIES_ARR = np.array(_CATEGORIES_TUP, dtype=object)
+_ITEMS_PER_CATEGORY = np.array([len(_PRODUCTS_BY_CATEGORY_TUP[c]) for c in _CATEGORIES_TUP])
+_CATEGORY_OFFSETS = np.concatenate(([0], np.cumsum(_ITEMS_PER_CATEGORY)[:-1]))
+_FLAT_PRODUCTS = [item_data for c in _CATEGORIES_TUP for item_data in _PRODUCTS_BY_CATEGORY_TUP[c]]
+_ITEMS_ARR = np.array([item_data["item"] for item_data in _FLAT_PRODUCTS], dtype=object)
+_MIN_PRICES = np.array([item_data["price_range"][0] for item_data in _FLAT_PRODUCTS], dtype=float)
+_MAX_PRICES = np.array([item_data["price_range"][1] for item_data in _FLAT_PRODUCTS], dtype=float)
+
+def _sample_items(rng, n):
+    """
+    Выборка n строк чеков сразу массивами: категория, товар, цена,
+    количество и скидка
+    """
+    # Категория и товар внутри категории
+    category_idx = rng.integers(0, len(_CATEGORIES_ARR), size=n)
+    item_idx = _CATEGORY_OFFSETS[category_idx] + rng.integers(
+        0, _ITEMS_PER_CATEGORY[category_idx]
+    )
+    
+    amount = rng.integers(1, 6, size=n)
+    has_discount = rng.random(n) < DISCOUNT_PROBABILITY
+    discount_percent = rng.uniform(DISCOUNT_RANGE[0], DISCOUNT_RANGE[1], size=n)
+    
+    # Округление одним векторным проходом; скидка считается от округленной цены
+    price = np.round(rng.uniform(_MIN_PRICES[item_idx], _MAX_PRICES[item_idx]), 2)
+    discount = np.where(has_discount, np.round(price * discount_percent, 2), 0.0)
+    return category_idx, item_idx, price, amount, discount
+
 class DataGenerator:
-    def __init__(self, num_stores=NUM_STORES):
+    def __init__(self, num_stores=NUM_STORES, file_format=FILE_FORMAT):
         self.num_stores = num_stores
+        self.file_format = file_format
         self.stores = {}
+        self.rng = np.random.default_rng()
         self.initialize_stores()
     
     def initialize_stores(self):
@@ -37,75 +72,62 @@ class DataGenerator:
                 'num_cash_registers': num_cash_registers,
                 'cash_registers': list(range(1, num_cash_registers + 1))
             }
-        logger.info(f"Инициализировано {self.num_stores} магазинов")
+        logger.info("Инициализировано %s магазинов", self.num_stores)
     
-    def generate_doc_id(self):
-        """Генерация уникального ID чека"""
+    def generate_doc_ids(self, n, rng=None):
+        """Генерация n ID чеков одним пакетом (формат: YYMMDDHHMMSS_XXXXXX)"""
+        if rng is None:
+            rng = self.rng
         timestamp = datetime.now().strftime('%y%m%d%H%M%S')
-        random_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        return f"{timestamp}_{random_part}"
-    
-    def select_item_from_category(self, category):
-        """Выбор случайного товара из категории"""
-        items = PRODUCTS_BY_CATEGORY[category]
-        item_data = random.choice(items)
-        return item_data
-    
-    def calculate_discount(self, price):
-        """Расчет скидки для товара"""
-        if random.random() < DISCOUNT_PROBABILITY:
-            discount_percent = random.uniform(DISCOUNT_RANGE[0], DISCOUNT_RANGE[1])
-            discount_amount = round(price * discount_percent, 2)
-            return discount_amount
-        return 0.0
-    
-    def generate_receipt(self, store_id, cash_id, receipt_date):
-        """Генерация одного чека"""
-        doc_id = self.generate_doc_id()
-        num_items = random.randint(
-            config.ITEMS_PER_RECEIPT_MIN,
-            config.ITEMS_PER_RECEIPT_MAX
-        )
-        
-        receipt_items = []
-        for _ in range(num_items):
-            # Выбираем случайную категорию
-            category = random.choice(CATEGORIES)
-            
-            # Выбираем случайный товар из категории
-            item_data = self.select_item_from_category(category)
-            item_name = item_data["item"]
-            min_price, max_price = item_data["price_range"]
-            price = random.uniform(min_price, max_price)
-            
-            amount = random.randint(1, 5)
-            discount = self.calculate_discount(price)
-            
-            receipt_items.append({
-                'doc_id': doc_id,
-                'item': item_name,
-                'category': category,
-                'amount': amount,
-                'price': round(price, 2),
-                'discount': discount,
-                'store_id': store_id,
-                'cash_id': cash_id,
-                'receipt_date': receipt_date
-            })
-        
-        return receipt_items
+        codes = _DOC_ID_ALPHABET_CODES[rng.integers(0, len(_DOC_ID_ALPHABET_CODES), size=(n, 6))]
+        random_parts = codes.view('S6').ravel()
+        return np.char.add(f"{timestamp}_", random_parts.astype('U6')).astype(object)
     
     def generate_cash_data(self, store_id, cash_id, date, num_receipts=None):
         """Генерация данных для одной кассы за день"""
         if num_receipts is None:
             num_receipts = random.randint(30, config.RECEIPTS_PER_CASH_PER_DAY)
         
-        all_items = []
-        for _ in range(num_receipts):
-            receipt_items = self.generate_receipt(store_id, cash_id, date)
-            all_items.extend(receipt_items)
+        # Отдельный поток случайных чисел на кассу: генерацию касс
+        # можно распараллелить без общего состояния генератора
+        rng = self.rng.spawn(1)[0]
+        
+        # Количество товаров в каждом чеке
+        items_per_receipt = rng.integers(
+            config.ITEMS_PER_RECEIPT_MIN,
+            config.ITEMS_PER_RECEIPT_MAX + 1,
+            size=num_receipts
+        )
+        category_idx, item_idx, price, amount, discount = _sample_items(
+            rng, int(items_per_receipt.sum())
+        )
+        
+        doc_ids = self.generate_doc_ids(num_receipts, rng)
         
-        return pd.DataFrame(all_items)
+        return pd.DataFrame({
+            'doc_id': np.repeat(doc_ids, items_per_receipt),
+            # Словарное кодирование: индексы по каталогу вместо строк на каждую строку
+            'item': pd.Categorical.from_codes(item_idx, categories=_ITEMS_ARR),
+            'category': pd.Categorical.from_codes(category_idx, categories=_CATEGORIES_ARR),
+            'amount': amount,
+            'price': price,
+            'discount': discount,
+            'store_id': store_id,
+            'cash_id': cash_id,
+            'receipt_date': date
+        })
+    
+    def write_file(self, df, filename):
+        """Сохранение данных кассы в файл (parquet или csv)"""
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.file_format == 'parquet':
+            pq.write_table(table, str(filename), compression='zstd')
+        else:
+            pacsv.write_csv(
+                table,
+                str(filename),
+                write_options=pacsv.WriteOptions(batch_size=8192)
+            )
     
     def generate_daily_files(self, target_date=None, force=False):
         """
@@ -122,12 +144,12 @@ class DataGenerator:
         
         # Проверка на воскресенье
         if target_date.weekday() == 6 and not force:
-            logger.info(f"Воскресенье {target_date.date()} - генерация отключена")
+            logger.info("Воскресенье %s - генерация отключена", target_date.date())
             return 0
         
         # Проверка на праздники
         if target_date.strftime("%Y-%m-%d") in GENERATION_SETTINGS['holidays'] and not force:
-            logger.info(f"Праздничный день {target_date.date()} - генерация отключена")
+            logger.info("Праздничный день %s - генерация отключена", target_date.date())
             return 0
         
         date_str = target_date.strftime("%Y-%m-%d")
@@ -146,17 +168,17 @@ class DataGenerator:
                 # Генерация данных
                 df = self.generate_cash_data(store_id, cash_id, target_date.date(), num_receipts)
                 
-                # Сохранение в CSV
-                filename = day_dir / f"{store_id}_{cash_id}.csv"
-                df.to_csv(filename, index=False, encoding='utf-8')
+                # Сохранение в файл
+                filename = day_dir / f"{store_id}_{cash_id}.{self.file_format}"
+                self.write_file(df, filename)
                 
                 generated_files += 1
                 total_items += len(df)
                 
-                logger.info(f"Сгенерирован файл: {filename} "
-                          f"(чеков: {num_receipts}, товаров: {len(df)})")
+                logger.info("Сгенерирован файл: %s (чеков: %d, товаров: %d)",
+                            filename, num_receipts, len(df))
         
-        logger.info(f"Всего сгенерировано: {generated_files} файлов, {total_items} записей")
+        logger.info("Всего сгенерировано: %s файлов, %s записей", generated_files, total_items)
         return generated_files
     
     def generate_date_range(self, start_date, end_date):
@@ -168,13 +190,13 @@ class DataGenerator:
         current_date = start
         
         while current_date <= end:
-            logger.info(f"Генерация данных за {current_date.date()}")
+            logger.info("Генерация данных за %s", current_date.date())
             files_generated = self.generate_daily_files(current_date)
             total_files += files_generated
             
             current_date += timedelta(days=1)
         
-        logger.info(f"Генерация завершена. Всего файлов: {total_files}")
+        logger.info("Генерация завершена. Всего файлов: %s", total_files)
         return total_files
 
 def main():
@@ -185,24 +207,32 @@ def main():
     parser.add_argument('--start-date', type=str, help='Начальная дата для генерации диапазона')
     parser.add_argument('--end-date', type=str, help='Конечная дата для генерации диапазона')
     parser.add_argument('--force', action='store_true', help='Генерировать даже в выходные')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=FILE_FORMAT,
+                       help=f'Формат файлов (по умолчанию: {FILE_FORMAT})')
     parser.add_argument('--verbose', '-v', action='store_true', help='Подробный вывод')
     
     args = parser.parse_args()
     
-    if args.verbose:
-        logger.setLevel(logging.DEBUG)
-    
-    generator = DataGenerator(num_stores=args.stores)
+    # Настройка логирования (запись на диск в фоновом потоке)
+    listener = setup_logging(
+        'logs/generator.log',
+        logging.DEBUG if args.verbose else logging.INFO
+    )
     
-    if args.start_date and args.end_date:
-        # Генерация диапазона дат
-        generator.generate_date_range(args.start_date, args.end_date)
-    elif args.date:
-        # Генерация за конкретную дату
-        generator.generate_daily_files(args.date, args.force)
-    else:
-        # Генерация за сегодня
-        generator.generate_daily_files(force=args.force)
+    try:
+        generator = DataGenerator(num_stores=args.stores, file_format=args.format)
+        
+        if args.start_date and args.end_date:
+            # Генерация диапазона дат
+            generator.generate_date_range(args.start_date, args.end_date)
+        elif args.date:
+            # Генерация за конкретную дату
+            generator.generate_daily_files(args.date, args.force)
+        else:
+            # Генерация за сегодня
+            generator.generate_daily_files(force=args.force)
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,171 +2,336 @@
 Модуль загрузки данных из CSV файлов в базу данных
 """
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
 from pathlib import Path
 from datetime import datetime
-import re
 import logging
+import os
 from typing import List, Optional
 import argparse
-import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
-from config import DATA_DIR, MAX_RETRIES
-from simple_database import SimpleDB
+from config import DATA_DIR, DATA_FILE_EXTENSIONS, LOAD_WORKERS, MAX_RETRIES
+from simple_database import SimpleDB, RECEIPT_COLUMNS
+from log_utils import setup_logging, worker_logging
 
 logger = logging.getLogger(__name__)
 
+# Типы числовых колонок при чтении CSV через pyarrow
+CSV_COLUMN_TYPES = {
+    'amount': pa.int32(),
+    'price': pa.float64(),
+    'discount': pa.float64(),
+}
+
+# Заданий разбора в очереди пула на один процесс-обработчик
+PREPARE_WINDOW_PER_WORKER = 2
+
 class DataLoader:
     """Класс для загрузки данных в БД"""
     
-    def __init__(self):
+    def __init__(self, workers: int = LOAD_WORKERS):
         self.db = SimpleDB()
+        self.workers = workers
+        # Успешно обработанные файлы: один запрос на запуск вместо запроса на файл
+        self._processed = self.db.load_processed_set()
         self.processed_count = 0
         self.error_count = 0
         self.total_records = 0
     
-    def extract_store_cash_from_filename(self, filename: str) -> Optional[tuple]:
+    @staticmethod
+    def extract_store_cash_from_filename(filename: Path) -> Optional[tuple]:
         """Извлечение номера магазина и кассы из имени файла"""
-        match = re.match(r'(\d+)_(\d+)\.csv$', filename.name)
-        if match:
-            return int(match.group(1)), int(match.group(2))
-        return None
+        stem, _, ext = filename.name.rpartition('.')
+        if f".{ext}" not in DATA_FILE_EXTENSIONS:
+            return None
+        store, sep, cash = stem.partition('_')
+        if not sep or not store.isdecimal() or not cash.isdecimal():
+            return None
+        return int(store), int(cash)
     
-    def validate_csv_file(self, filepath: Path) -> bool:
-        """Валидация CSV файла"""
+    @staticmethod
+    def validate_csv_file(filepath: Path, store_cash: Optional[tuple] = None) -> bool:
+        """Валидация файла с данными (CSV или Parquet)"""
         try:
             # Проверяем расширение
-            if filepath.suffix.lower() != '.csv':
+            if filepath.suffix.lower() not in DATA_FILE_EXTENSIONS:
                 return False
             
-            # Проверяем имя файла (формат store_cash.csv)
-            if not self.extract_store_cash_from_filename(filepath):
-                logger.warning(f"Неверный формат имени файла: {filepath.name}")
+            # Проверяем имя файла (формат store_cash.csv / store_cash.parquet)
+            if store_cash is None:
+                store_cash = DataLoader.extract_store_cash_from_filename(filepath)
+            if not store_cash:
+                logger.warning("Неверный формат имени файла: %s", filepath.name)
                 return False
             
             # Проверяем что файл не пустой
             if filepath.stat().st_size == 0:
-                logger.warning(f"Файл пустой: {filepath}")
+                logger.warning("Файл пустой: %s", filepath)
                 return False
             
             return True
             
         except Exception as e:
-            logger.error(f"Ошибка валидации файла {filepath}: {e}")
+            logger.error("Ошибка валидации файла %s: %s", filepath, e)
             return False
     
-    def read_and_prepare_data(self, filepath: Path) -> Optional[pd.DataFrame]:
-        """Чтение и подготовка данных из CSV файла"""
+    @staticmethod
+    def read_csv_typed(filepath: Path) -> Optional[pa.Table]:
+        """
+        Многопоточное чтение CSV через pyarrow с типизацией числовых колонок.
+        Возвращает None, если значения не приводятся к типам
+        """
         try:
-            # Извлекаем информацию из имени файла
-            store_id, cash_id = self.extract_store_cash_from_filename(filepath)
+            return pacsv.read_csv(
+                filepath,
+                read_options=pacsv.ReadOptions(block_size=1 << 20),
+                convert_options=pacsv.ConvertOptions(
+                    column_types=CSV_COLUMN_TYPES,
+                    strings_can_be_null=True
+                )
+            )
+        except pa.ArrowInvalid as e:
+            logger.debug("Типизированное чтение %s не удалось: %s", filepath.name, e)
+            return None
+    
+    @staticmethod
+    def read_csv_coerced(filepath: Path) -> pa.Table:
+        """Чтение CSV через pandas с приведением некорректных чисел к пропускам"""
+        df = pd.read_csv(filepath, encoding='utf-8')
+        for column in CSV_COLUMN_TYPES:
+            if column in df.columns:
+                df[column] = pd.to_numeric(df[column], errors='coerce')
+        return pa.Table.from_pandas(df, preserve_index=False)
+    
+    @staticmethod
+    def read_and_prepare_data(filepath: Path, store_cash: Optional[tuple] = None) -> Optional[pa.Table]:
+        """Чтение и подготовка данных из CSV или Parquet файла в таблицу Arrow"""
+        try:
+            # Извлекаем информацию из имени файла (если не передана)
+            if store_cash is None:
+                store_cash = DataLoader.extract_store_cash_from_filename(filepath)
+            store_id, cash_id = store_cash
             
             # Извлекаем дату из пути
             date_str = filepath.parent.name
             try:
                 receipt_date = datetime.strptime(date_str, "%Y-%m-%d").date()
             except ValueError:
-                logger.error(f"Неверный формат даты в пути: {date_str}")
+                logger.error("Неверный формат даты в пути: %s", date_str)
                 return None
             
-            # Читаем CSV файл
-            df = pd.read_csv(filepath, encoding='utf-8')
+            # Читаем файл: Parquet хранит типы колонок, CSV читаем типизированно
+            # через pyarrow, а при некорректных значениях - через pandas с приведением
+            if filepath.suffix.lower() == '.parquet':
+                table = pq.read_table(filepath)
+            else:
+                table = DataLoader.read_csv_typed(filepath)
+                if table is None:
+                    table = DataLoader.read_csv_coerced(filepath)
             
             # Проверяем обязательные колонки
             required_columns = ['doc_id', 'item', 'category', 'amount', 'price', 'discount']
-            missing_columns = [col for col in required_columns if col not in df.columns]
+            missing_columns = [col for col in required_columns if col not in table.column_names]
             
             if missing_columns:
-                logger.error(f"Отсутствуют обязательные колонки в {filepath}: {missing_columns}")
+                logger.error("Отсутствуют обязательные колонки в %s: %s", filepath, missing_columns)
                 return None
             
-            # Очистка данных
-            df = df.dropna(subset=['doc_id', 'item'])  # Удаляем строки без doc_id или item
-            df = df.fillna({'discount': 0})  # Заполняем пропуски в скидке
+            # Очистка данных: удаляем строки без doc_id, item или category
+            # (товар и категория заменяются на id справочников, пустые значения не сохранятся)
+            item = table['item'].cast(pa.string())
+            category = table['category'].cast(pa.string())
+            table = table.filter(pc.and_(
+                pc.is_valid(table['doc_id']),
+                pc.and_(
+                    pc.and_(pc.is_valid(item), pc.not_equal(item, '')),
+                    pc.and_(pc.is_valid(category), pc.not_equal(category, ''))
+                )
+            ))
             
-            # Преобразование типов
-            df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(1).astype(int)
-            df['price'] = pd.to_numeric(df['price'], errors='coerce').fillna(0)
-            df['discount'] = pd.to_numeric(df['discount'], errors='coerce').fillna(0)
+            # Преобразование типов и заполнение пропусков
+            # (дробное количество отбрасывает дробную часть, как astype(int) ранее)
+            amount = pc.fill_null(table['amount'], 1)
+            if pa.types.is_floating(amount.type):
+                amount = pc.trunc(amount)
+            amount = amount.cast(pa.int32())
+            price = pc.fill_null(table['price'], 0).cast(pa.float64())
+            discount = pc.fill_null(table['discount'], 0).cast(pa.float64())
             
             # Удаляем некорректные строки
-            df = df[(df['amount'] > 0) & (df['price'] >= 0) & (df['discount'] >= 0)]
-            
-            # Добавляем метаданные
-            df['store_id'] = store_id
-            df['cash_id'] = cash_id
-            df['receipt_date'] = receipt_date
+            valid = pc.and_(
+                pc.and_(pc.greater(amount, 0), pc.greater_equal(price, 0)),
+                pc.greater_equal(discount, 0)
+            )
+            num_rows = pc.sum(valid.cast(pa.int64())).as_py() or 0
             
-            # Округление денежных значений
-            df['price'] = df['price'].round(2)
-            df['discount'] = df['discount'].round(2)
+            # Собираем колонки receipts в порядке вставки в БД,
+            # добавляя метаданные и округляя денежные значения
+            columns = {
+                'doc_id': table['doc_id'].cast(pa.string()).filter(valid),
+                'store_id': pa.repeat(pa.scalar(store_id, pa.int32()), num_rows),
+                'cash_id': pa.repeat(pa.scalar(cash_id, pa.int32()), num_rows),
+                'item': table['item'].cast(pa.string()).filter(valid),
+                'category': table['category'].cast(pa.string()).filter(valid),
+                'amount': amount.filter(valid),
+                'price': pc.round(price.filter(valid), 2),
+                'discount': pc.round(discount.filter(valid), 2),
+                'receipt_date': pa.repeat(pa.scalar(receipt_date, pa.date32()), num_rows),
+            }
+            table = pa.table([columns[column] for column in RECEIPT_COLUMNS], names=list(RECEIPT_COLUMNS))
             
-            logger.debug(f"Прочитано {len(df)} записей из {filepath.name}")
-            return df
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Прочитано %d записей из %s", table.num_rows, filepath.name)
+            return table
             
         except Exception as e:
-            logger.error(f"Ошибка чтения файла {filepath}: {e}")
+            logger.error("Ошибка чтения файла %s: %s", filepath, e)
             return None
     
-    def process_file(self, filepath: Path) -> bool:
-        """Обработка одного CSV файла"""
+    @staticmethod
+    def prepare_file(filepath: Path) -> Optional[pa.Table]:
+        """
+        Валидация и чтение файла без обращения к БД
+        (выполняется в процессах-обработчиках)
+        """
+        # Имя файла разбираем один раз для валидации и чтения
+        store_cash = DataLoader.extract_store_cash_from_filename(filepath)
+        if not DataLoader.validate_csv_file(filepath, store_cash):
+            return None
+        return DataLoader.read_and_prepare_data(filepath, store_cash)
+    
+    def save_prepared_data(self, filepath: Path, table: Optional[pa.Table]) -> bool:
+        """Загрузка подготовленных данных файла в БД"""
         filename = filepath.name
         
-        # Пропускаем если файл уже обработан
-        if self.db.is_file_processed(filename):
-            logger.info(f"Файл уже обработан: {filename}")
-            return True
-        
-        # Валидация файла
-        if not self.validate_csv_file(filepath):
+        if table is None or table.num_rows == 0:
             return False
         
-        # Чтение данных
-        df = self.read_and_prepare_data(filepath)
-        if df is None or df.empty:
-            return False
-        
-        # Преобразуем DataFrame в список словарей
-        data = df.to_dict('records')
-        
-        # Загружаем данные в БД
-        success = self.db.save_file_data(filename, data)
+        success = self.db.save_file_data(filename, table)
         
         if success:
+            self._processed.add(filename)
             self.processed_count += 1
-            self.total_records += len(df)
-            logger.info(f"Успешно обработан файл: {filename} ({len(df)} записей)")
+            self.total_records += table.num_rows
+            logger.info("Успешно обработан файл: %s (%s записей)", filename, table.num_rows)
         else:
             self.error_count += 1
-            logger.error(f"Ошибка обработки файла: {filename}")
+            logger.error("Ошибка обработки файла: %s", filename)
+        
+        return success
+    
+    def stage_prepared_data(self, filepath: Path, table: Optional[pa.Table]) -> bool:
+        """Копирование подготовленных данных файла в receipts_staging"""
+        if table is None or table.num_rows == 0:
+            return False
+        
+        success = self.db.stage_file_data(filepath.name, table)
+        if not success:
+            self.error_count += 1
+            logger.error("Ошибка обработки файла: %s", filepath.name)
+        return success
+    
+    def finish_bulk_load(self, staged_files: List[tuple]) -> bool:
+        """
+        Перенос подготовленных файлов из receipts_staging в receipts.
+        staged_files: пары (имя файла, количество записей) по каждому файлу;
+        одно имя повторяется для разных дат
+        """
+        success = self.db.finish_bulk_load(staged_files)
+        
+        if success:
+            self._processed.update(filename for filename, _ in staged_files)
+            self.processed_count += len(staged_files)
+            self.total_records += sum(count for _, count in staged_files)
+        else:
+            self.error_count += len(staged_files)
         
         return success
     
+    def process_file(self, filepath: Path) -> bool:
+        """Обработка одного CSV файла"""
+        filename = filepath.name
+        
+        # Пропускаем если файл уже обработан
+        if filename in self._processed:
+            logger.info("Файл уже обработан: %s", filename)
+            return True
+        
+        # Валидация и чтение данных
+        table = self.prepare_file(filepath)
+        
+        # Загружаем данные в БД
+        return self.save_prepared_data(filepath, table)
+    
     def find_csv_files(self, base_dir: Path = None) -> List[Path]:
-        """Поиск CSV файлов в папке и подпапках"""
+        """Поиск файлов с данными (CSV и Parquet) в папках с датами"""
         if base_dir is None:
             base_dir = DATA_DIR
         
         csv_files = []
         
-        # Ищем во всех подпапках
-        for csv_file in base_dir.rglob("*.csv"):
-            # Проверяем что файл находится в папке с датой (формат YYYY-MM-DD)
-            try:
-                date_str = csv_file.parent.name
-                datetime.strptime(date_str, "%Y-%m-%d")
-                csv_files.append(csv_file)
-            except ValueError:
-                # Пропускаем файлы не в папках с датами
-                logger.warning(f"Файл вне папки с датой: {csv_file}")
-                continue
+        # Файлы ищем только в папках с датой (формат YYYY-MM-DD):
+        # дата проверяется один раз на папку, а не на каждый файл
+        with os.scandir(base_dir) as date_entries:
+            for date_entry in date_entries:
+                if not date_entry.is_dir():
+                    if date_entry.name.lower().endswith(DATA_FILE_EXTENSIONS):
+                        logger.warning("Файл вне папки с датой: %s", date_entry.path)
+                    continue
+                
+                try:
+                    datetime.strptime(date_entry.name, "%Y-%m-%d")
+                except ValueError:
+                    # Пропускаем папки, название которых не является датой
+                    logger.warning("Папка без даты в названии пропущена: %s", date_entry.path)
+                    continue
+                
+                with os.scandir(date_entry.path) as file_entries:
+                    for file_entry in file_entries:
+                        if file_entry.name.lower().endswith(DATA_FILE_EXTENSIONS) and file_entry.is_file():
+                            csv_files.append(Path(file_entry.path))
         
         # Сортируем по дате (из пути) и имени файла
         csv_files.sort(key=lambda x: (x.parent.name, x.name))
         
         return csv_files
     
-    def process_all_files(self, specific_date: str = None) -> dict:
-        """Обработка всех CSV файлов"""
+    def prepare_files(self, files: List[Path]):
+        """
+        Подготовка файлов (параллельно в процессах, если workers > 1).
+        Возвращает пары (файл, таблица) в исходном порядке
+        """
+        if self.workers > 1 and len(files) > 1:
+            with worker_logging() as (initializer, initargs), \
+                    ProcessPoolExecutor(max_workers=self.workers,
+                                        initializer=initializer,
+                                        initargs=initargs) as executor:
+                # Ограниченное окно заданий: в памяти не больше PREPARE_WINDOW_PER_WORKER
+                # подготовленных таблиц на процесс, даже если запись в БД отстает
+                pending = deque()
+                files_iter = iter(files)
+                for filepath in islice(files_iter, self.workers * PREPARE_WINDOW_PER_WORKER):
+                    pending.append((filepath, executor.submit(self.prepare_file, filepath)))
+                while pending:
+                    filepath, future = pending.popleft()
+                    for next_file in islice(files_iter, 1):
+                        pending.append((next_file, executor.submit(self.prepare_file, next_file)))
+                    yield filepath, future.result()
+        else:
+            for filepath in files:
+                yield filepath, self.prepare_file(filepath)
+    
+    def process_all_files(self, specific_date: str = None, bulk: bool = False) -> dict:
+        """
+        Обработка всех CSV файлов.
+        bulk: массовая загрузка через receipts_staging одним INSERT ... SELECT
+        """
         logger.info("Начало обработки файлов...")
         
         start_time = datetime.now()
@@ -183,27 +348,51 @@ class DataLoader:
                 'duration': 0
             }
         
-        logger.info(f"Найдено {len(csv_files)} CSV файлов для обработки")
+        logger.info("Найдено %s CSV файлов для обработки", len(csv_files))
         
         # Фильтруем по дате если указано
         if specific_date:
             csv_files = [f for f in csv_files if f.parent.name == specific_date]
-            logger.info(f"Фильтр по дате {specific_date}: {len(csv_files)} файлов")
+            logger.info("Фильтр по дате %s: %s файлов", specific_date, len(csv_files))
         
-        # Обрабатываем файлы
+        # Уже обработанные файлы отсеиваем до разбора
+        pending_files = []
         for csv_file in csv_files:
-            self.process_file(csv_file)
+            if csv_file.name in self._processed:
+                logger.info("Файл уже обработан: %s", csv_file.name)
+            else:
+                pending_files.append(csv_file)
+        
+        # Обрабатываем файлы: разбор параллельно в процессах,
+        # запись в БД последовательно через одно соединение
+        try:
+            if bulk:
+                self.db.begin_bulk_load()
+                staged_files = []
+                for csv_file, table in self.prepare_files(pending_files):
+                    if self.stage_prepared_data(csv_file, table):
+                        staged_files.append((csv_file.name, table.num_rows))
+                if staged_files:
+                    self.finish_bulk_load(staged_files)
+            else:
+                for csv_file, table in self.prepare_files(pending_files):
+                    self.save_prepared_data(csv_file, table)
+        finally:
+            self.db.close()
         
         # Статистика
         duration = (datetime.now() - start_time).total_seconds()
         
         logger.info("\n" + "="*50)
         logger.info("ОБРАБОТКА ЗАВЕРШЕНА")
-        logger.info(f"Обработано файлов: {self.processed_count}")
-        logger.info(f"Ошибок: {self.error_count}")
-        logger.info(f"Всего записей: {self.total_records}")
-        logger.info(f"Время выполнения: {duration:.2f} сек")
-        logger.info(f"Скорость: {self.total_records/duration:.1f} записей/сек" if duration > 0 else "Скорость: N/A")
+        logger.info("Обработано файлов: %s", self.processed_count)
+        logger.info("Ошибок: %s", self.error_count)
+        logger.info("Всего записей: %s", self.total_records)
+        logger.info("Время выполнения: %.2f сек", duration)
+        if duration > 0:
+            logger.info("Скорость: %.1f записей/сек", self.total_records / duration)
+        else:
+            logger.info("Скорость: N/A")
         logger.info("="*50)
         
         return {
@@ -219,33 +408,38 @@ def main():
     parser.add_argument('--file', type=str, help='Конкретный файл для обработки')
     parser.add_argument('--verbose', '-v', action='store_true', help='Подробный вывод')
     parser.add_argument('--force', action='store_true', help='Перезапись существующих данных')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Массовая загрузка через промежуточную таблицу (для больших загрузок)')
+    parser.add_argument('--workers', type=int, default=LOAD_WORKERS,
+                        help=f'Количество процессов для разбора файлов (по умолчанию: {LOAD_WORKERS})')
     
     args = parser.parse_args()
     
-    # Настройка логирования
-    log_level = logging.DEBUG if args.verbose else logging.INFO
-    logging.basicConfig(
-        level=log_level,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('logs/loader.log'),
-            logging.StreamHandler(sys.stdout)
-        ]
+    # Настройка логирования: запись на диск в фоновом потоке
+    # (очередь для процессов-обработчиков создается при запуске пула)
+    listener = setup_logging(
+        'logs/loader.log',
+        logging.DEBUG if args.verbose else logging.INFO
     )
     
-    # Создаем и запускаем загрузчик
-    loader = DataLoader()
-    
-    if args.file:
-        # Обработка конкретного файла
-        filepath = Path(args.file)
-        if filepath.exists():
-            loader.process_file(filepath)
-        else:
-            logger.error(f"Файл не найден: {args.file}")
-    else:
-        # Обработка всех файлов
-        loader.process_all_files(args.date)
+    try:
+        # Создаем и запускаем загрузчик
+        loader = DataLoader(workers=args.workers)
+        try:
+            if args.file:
+                # Обработка конкретного файла
+                filepath = Path(args.file)
+                if filepath.exists():
+                    loader.process_file(filepath)
+                else:
+                    logger.error("Файл не найден: %s", args.file)
+            else:
+                # Обработка всех файлов
+                loader.process_all_files(args.date, bulk=args.bulk)
+        finally:
+            loader.db.close()
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
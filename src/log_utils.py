@@ -0,0 +1,64 @@
+"""
+Настройка логирования: запись в файл и консоль в фоновом потоке
+"""
+import logging
+import multiprocessing
+import queue
+import sys
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Обработчики (файл и консоль), настроенные в setup_logging
+_handlers = []
+
+def setup_logging(log_file: str, level: int = logging.INFO) -> QueueListener:
+    """
+    Логирование через очередь: вызывающий код только кладет запись в очередь,
+    форматирование и запись в файл/консоль выполняет QueueListener в своем потоке.
+    Возвращает запущенный listener (остановить через listener.stop())
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler(sys.stdout)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    _handlers[:] = handlers
+
+    # Внутри процесса достаточно SimpleQueue: без сериализации и потока-передатчика
+    log_queue = queue.SimpleQueue()
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+def init_worker_logging(log_queue, level: int):
+    """Инициализатор процесса-обработчика: записи логов уходят в очередь основного процесса"""
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+
+@contextmanager
+def worker_logging():
+    """
+    Аргументы initializer/initargs для ProcessPoolExecutor.
+    multiprocessing.Queue создается только на время работы пула, записи из нее
+    пишет отдельный listener в те же обработчики. Пустые, если логирование
+    не настроено через setup_logging
+    """
+    if not _handlers:
+        yield None, ()
+        return
+
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        yield init_worker_logging, (log_queue, logging.getLogger().level)
+    finally:
+        listener.stop()
+        log_queue.close()
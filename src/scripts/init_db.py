@@ -6,11 +6,12 @@ import sys
 from pathlib import Path
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
 
 # Добавляем корневую папку в путь Python
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from config import DB_CONFIG, check_required_env_vars
+from config import DB_CONFIG, CATEGORIES, PRODUCTS_BY_CATEGORY, check_required_env_vars
 
 def create_database():
     """Создание базы данных если она не существует"""
@@ -60,6 +61,54 @@ def execute_sql_file(filepath, connection):
     finally:
         cursor.close()
 
+def has_legacy_receipts(connection) -> bool:
+    """
+    Проверка, что receipts создана прежней схемой (item и category строками,
+    без item_id/category_id): CREATE TABLE IF NOT EXISTS ее не изменит
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('receipts') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND table_name = 'receipts' AND column_name = 'item_id'
+        """)
+        return cursor.fetchone() is None
+    finally:
+        cursor.close()
+
+def seed_catalog(connection):
+    """Заполнение справочников categories и items из каталога config.py"""
+    cursor = connection.cursor()
+    try:
+        execute_values(
+            cursor,
+            "INSERT INTO categories (name) VALUES %s ON CONFLICT (name) DO NOTHING",
+            [(category,) for category in CATEGORIES]
+        )
+        execute_values(cursor, """
+            INSERT INTO items (name, category_id)
+            SELECT v.name, c.id
+            FROM (VALUES %s) AS v(name, category)
+            JOIN categories c ON c.name = v.category
+            ON CONFLICT (name) DO NOTHING
+        """, [
+            (item_data["item"], category)
+            for category in CATEGORIES
+            for item_data in PRODUCTS_BY_CATEGORY[category]
+        ])
+        connection.commit()
+        print("Справочники категорий и товаров заполнены")
+    except Exception as e:
+        connection.rollback()
+        print(f"Ошибка при заполнении справочников: {e}")
+        raise
+    finally:
+        cursor.close()
+
 def main():
     """Основная функция инициализации БД"""
     print("Инициализация базы данных PostgreSQL")
@@ -75,6 +124,15 @@ def main():
         conn = psycopg2.connect(**DB_CONFIG)
         print("Подключение к базе данных установлено")
         
+        # Таблица receipts прежней схемы не обновляется автоматически
+        if has_legacy_receipts(conn):
+            print("\nТаблица receipts создана прежней схемой (без item_id/category_id и секций по месяцам).")
+            print("Пересоздайте ее и повторите инициализацию (данные будут удалены, файлы загрузятся заново):")
+            print("  DROP TABLE receipts CASCADE;")
+            print("  DELETE FROM processed_files;")
+            conn.close()
+            sys.exit(1)
+        
         # Выполняем SQL файлы по порядку
         sql_dir = Path(__file__).parent.parent / "sql"
         sql_files = [
@@ -89,9 +147,14 @@ def main():
             else:
                 print(f"Файл не найден: {sql_file}")
         
+        # Заполняем справочники из каталога товаров
+        seed_catalog(conn)
+        
         print("\nИнициализация базы данных завершена!")
         print("Созданы таблицы:")
+        print("  - categories, items (справочники категорий и товаров)")
         print("  - receipts (чеки)")
+        print("  - receipts_staging (промежуточная таблица массовой загрузки)")
         print("  - processed_files (обработанные файлы)")
         
         # Закрываем соединение
@@ -1,53 +1,232 @@
 """
 упрощенный модуль для работы с БД PostgreSQL
 """
+import io
+import numpy as np
 import psycopg2
+from psycopg2.extras import execute_values
 import logging
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
-from config import DB_CONFIG
+from config import DB_CONFIG, BATCH_SIZE, INSERT_METHOD
 
 logger = logging.getLogger(__name__)
 
+# Соответствие колонок подготовленных данных колонкам промежуточных таблиц
+# (receipts_load / receipts_staging); item и category в receipts заменяются
+# на item_id и category_id из справочников при переносе
+RECEIPT_COLUMNS = {
+    'doc_id': 'doc_id',
+    'store_id': 'store_id',
+    'cash_id': 'cash_id',
+    'item': 'item',
+    'category': 'category',
+    'amount': 'quantity',
+    'price': 'unit_price',
+    'discount': 'discount_amount',
+    'receipt_date': 'receipt_date',
+}
+
+# Колонки промежуточных таблиц: данные файла + имя файла и номер строки в нем
+LOAD_COLUMNS = ', '.join([*RECEIPT_COLUMNS.values(), 'file_name', 'line_no'])
+
+# Обновление строки при повторной загрузке файла (ключ: file_name, receipt_date, line_no)
+UPSERT_CLAUSE = """
+    ON CONFLICT (file_name, receipt_date, line_no) DO UPDATE
+    SET doc_id = EXCLUDED.doc_id,
+        store_id = EXCLUDED.store_id,
+        cash_id = EXCLUDED.cash_id,
+        item_id = EXCLUDED.item_id,
+        category_id = EXCLUDED.category_id,
+        quantity = EXCLUDED.quantity,
+        unit_price = EXCLUDED.unit_price,
+        discount_amount = EXCLUDED.discount_amount,
+        loaded_at = CURRENT_TIMESTAMP
+"""
+
 class SimpleDB:
     def __init__(self):
         self.params = DB_CONFIG
+        self.insert_method = INSERT_METHOD
+        # Одно соединение на весь запуск вместо подключения на каждый файл
+        self.conn = None
+        self.get_connection()
+        # Месяцы, для которых секция receipts уже создана в этом запуске,
+        # и созданные в текущей (еще не зафиксированной) транзакции
+        self._partitions = set()
+        self._pending_partitions = set()
     
     def connect(self):
         """Подключение к БД"""
         return psycopg2.connect(**self.params)
     
-    def save_file_data(self, filename: str, data: list) -> bool:
+    def get_connection(self):
+        """Текущее соединение (переподключение, если оно было закрыто)"""
+        if self.conn is None or self.conn.closed:
+            self.conn = self.connect()
+            self._create_staging_table()
+        return self.conn
+    
+    def _create_staging_table(self):
+        """
+        Временная таблица соединения для COPY перед upsert в receipts.
+        Строки очищаются при каждом commit
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS receipts_load (
+                doc_id VARCHAR(50),
+                store_id INTEGER,
+                cash_id INTEGER,
+                item VARCHAR(255),
+                category VARCHAR(100),
+                quantity INTEGER,
+                unit_price DECIMAL(10, 2),
+                discount_amount DECIMAL(10, 2),
+                receipt_date DATE,
+                file_name VARCHAR(255),
+                line_no INTEGER
+            ) ON COMMIT DELETE ROWS
+        """)
+        self.conn.commit()
+    
+    def close(self):
+        """Закрытие соединения с БД"""
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+    
+    @staticmethod
+    def _receipt_table(table: pa.Table) -> pa.Table:
+        """Таблица с колонками в порядке RECEIPT_COLUMNS (без копии, если порядок уже верный)"""
+        columns = list(RECEIPT_COLUMNS)
+        if table.column_names == columns:
+            return table
+        return table.select(columns)
+    
+    @staticmethod
+    def _with_file_columns(filename: str, table: pa.Table) -> pa.Table:
+        """Колонки receipts + имя файла и номер строки (ключ повторной загрузки)"""
+        table = SimpleDB._receipt_table(table)
+        table = table.append_column('file_name', pa.repeat(pa.scalar(filename), table.num_rows))
+        return table.append_column(
+            'line_no', pa.array(np.arange(1, table.num_rows + 1, dtype=np.int32))
+        )
+    
+    @staticmethod
+    def _to_copy_buffer(filename: str, table: pa.Table) -> io.BytesIO:
+        """Формирование CSV буфера для COPY средствами Arrow (без построчной обработки в Python)"""
+        table = SimpleDB._with_file_columns(filename, table)
+        buffer = io.BytesIO()
+        pacsv.write_csv(table, buffer, write_options=pacsv.WriteOptions(include_header=False))
+        buffer.seek(0)
+        return buffer
+    
+    @staticmethod
+    def _insert_values(cursor, filename: str, table: pa.Table):
+        """Пакетная вставка в receipts_load через execute_values (запасной вариант для COPY)"""
+        table = SimpleDB._with_file_columns(filename, table)
+        columns = [column.to_pylist() for column in table.columns]
+        execute_values(cursor, f"""
+            INSERT INTO receipts_load ({LOAD_COLUMNS})
+            VALUES %s
+        """, list(zip(*columns)), page_size=BATCH_SIZE)
+    
+    @staticmethod
+    def _merge_staged(cursor, source: str, distinct: bool = False):
+        """
+        Перенос строк промежуточной таблицы source в receipts: названия товаров
+        и категорий заменяются на id справочников (новые значения добавляются)
+        """
+        cursor.execute(f"""
+            INSERT INTO categories (name)
+            SELECT DISTINCT s.category FROM {source} s
+            WHERE NOT EXISTS (SELECT 1 FROM categories c WHERE c.name = s.category)
+            ON CONFLICT (name) DO NOTHING
+        """)
+        cursor.execute(f"""
+            INSERT INTO items (name, category_id)
+            SELECT DISTINCT ON (s.item) s.item, c.id
+            FROM {source} s
+            JOIN categories c ON c.name = s.category
+            WHERE NOT EXISTS (SELECT 1 FROM items i WHERE i.name = s.item)
+            ORDER BY s.item
+            ON CONFLICT (name) DO NOTHING
+        """)
+        distinct_on = "DISTINCT ON (s.file_name, s.receipt_date, s.line_no)" if distinct else ""
+        order_by = "ORDER BY s.file_name, s.receipt_date, s.line_no" if distinct else ""
+        cursor.execute(f"""
+            INSERT INTO receipts
+            (doc_id, store_id, cash_id, item_id, category_id,
+             quantity, unit_price, discount_amount,
+             receipt_date, file_name, line_no)
+            SELECT {distinct_on}
+                s.doc_id, s.store_id, s.cash_id, i.id, c.id,
+                s.quantity, s.unit_price, s.discount_amount,
+                s.receipt_date, s.file_name, s.line_no
+            FROM {source} s
+            JOIN items i ON i.name = s.item
+            JOIN categories c ON c.name = s.category
+            {order_by}
+            {UPSERT_CLAUSE}
+        """)
+    
+    def _ensure_partition(self, cursor, table: pa.Table):
+        """
+        Секция receipts для месяца даты файла. Возвращает дату файла.
+        Месяц запоминается только после commit (см. _commit)
         """
-        Сохранение данных из CSV файла
+        receipt_date = table['receipt_date'][0].as_py()
+        month = receipt_date.replace(day=1)
+        if month not in self._partitions:
+            cursor.execute("SELECT ensure_receipts_partition(%s)", (receipt_date,))
+            self._pending_partitions.add(month)
+        return receipt_date
+    
+    def _commit(self, conn):
+        """Фиксация транзакции и созданных в ней секций"""
+        conn.commit()
+        self._partitions.update(self._pending_partitions)
+        self._pending_partitions.clear()
+    
+    def _rollback(self, conn):
+        """Откат транзакции: созданные в ней секции тоже откатываются"""
+        conn.rollback()
+        self._pending_partitions.clear()
+    
+    def save_file_data(self, filename: str, table: pa.Table) -> bool:
+        """
+        Сохранение данных из CSV файла через COPY FROM STDIN
+        (или execute_values при INSERT_METHOD=values)
         """
         conn = None
         try:
-            conn = self.connect()
+            conn = self.get_connection()
             cursor = conn.cursor()
             
-            # Удаляем старые данные этого файла (если нужно перезаписать)
-            cursor.execute("DELETE FROM receipts WHERE file_name = %s", (filename,))
-            
-            # Вставляем данные
-            for row in data:
-                cursor.execute("""
-                    INSERT INTO receipts 
-                    (doc_id, store_id, cash_id, item, category, 
-                     quantity, unit_price, discount_amount, 
-                     receipt_date, file_name)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    row['doc_id'],
-                    row['store_id'],
-                    row['cash_id'],
-                    row['item'],
-                    row['category'],
-                    row['amount'],
-                    row['price'],
-                    row['discount'],
-                    row['receipt_date'],
-                    filename
-                ))
+            # Дата файла: секция receipts для ее месяца и отсечение секций в DELETE
+            receipt_date = self._ensure_partition(cursor, table)
+            
+            # Вставляем данные пачкой вместо INSERT на каждую строку;
+            # строки повторно загружаемого файла обновляются по (file_name, receipt_date, line_no)
+            if self.insert_method == 'values':
+                self._insert_values(cursor, filename, table)
+            else:
+                buffer = self._to_copy_buffer(filename, table)
+                cursor.copy_expert(f"""
+                    COPY receipts_load ({LOAD_COLUMNS})
+                    FROM STDIN WITH (FORMAT csv)
+                """, buffer)
+            self._merge_staged(cursor, 'receipts_load')
+            
+            # Удаляем строки, оставшиеся от прежней (более длинной) версии файла,
+            # и строки, загруженные до появления line_no
+            cursor.execute("""
+                DELETE FROM receipts
+                WHERE file_name = %s AND receipt_date = %s
+                  AND (line_no > %s OR line_no IS NULL)
+            """, (filename, receipt_date, table.num_rows))
             
             # Отмечаем файл как обработанный
             cursor.execute("""
@@ -57,53 +236,176 @@ class SimpleDB:
                 SET processed_at = CURRENT_TIMESTAMP,
                     status = 'success',
                     records_count = EXCLUDED.records_count
-            """, (filename, len(data)))
+            """, (filename, table.num_rows))
+            
+            self._commit(conn)
+            logger.info("Файл %s загружен: %s записей", filename, table.num_rows)
+            return True
             
+        except Exception as e:
+            logger.error("Ошибка загрузки %s: %s", filename, e)
+            if conn:
+                self._rollback(conn)
+                self._record_error(conn, filename, e)
+            return False
+    
+    def _record_error(self, conn, filename: str, error: Exception):
+        """Запись ошибки загрузки файла в processed_files"""
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO processed_files 
+                (file_name, status, error_message)
+                VALUES (%s, 'error', %s)
+                ON CONFLICT (file_name) DO UPDATE 
+                SET processed_at = CURRENT_TIMESTAMP,
+                    status = 'error',
+                    error_message = EXCLUDED.error_message
+            """, (filename, str(error)[:200]))  # обрезаем длинное сообщение
             conn.commit()
-            logger.info(f"Файл {filename} загружен: {len(data)} записей")
+        except Exception as inner_e:
+            logger.error("Не удалось записать ошибку: %s", inner_e)
+    
+    def begin_bulk_load(self):
+        """Начало массовой загрузки: очистка нежурналируемой таблицы receipts_staging"""
+        conn = self.get_connection()
+        conn.cursor().execute("TRUNCATE receipts_staging")
+        conn.commit()
+    
+    def stage_file_data(self, filename: str, table: pa.Table) -> bool:
+        """
+        COPY данных файла в receipts_staging (массовая загрузка).
+        В receipts строки попадают при finish_bulk_load
+        """
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            self._ensure_partition(cursor, table)
+            
+            buffer = self._to_copy_buffer(filename, table)
+            cursor.copy_expert(f"""
+                COPY receipts_staging ({LOAD_COLUMNS})
+                FROM STDIN WITH (FORMAT csv)
+            """, buffer)
+            
+            self._commit(conn)
+            logger.debug("Файл %s подготовлен к загрузке: %s записей", filename, table.num_rows)
             return True
             
         except Exception as e:
-            logger.error(f"Ошибка загрузки {filename}: {e}")
+            logger.error("Ошибка загрузки %s: %s", filename, e)
             if conn:
-                conn.rollback()
+                self._rollback(conn)
+                self._record_error(conn, filename, e)
+            return False
+    
+    def finish_bulk_load(self, files: list) -> bool:
+        """
+        Перенос receipts_staging в receipts одним INSERT ... SELECT.
+        На время вставки вторичные индексы receipts удаляются и затем
+        строятся заново. files: пары (имя файла, количество записей)
+        """
+        # processed_files хранит имя без даты: записи одного имени за разные
+        # даты суммируются (ON CONFLICT не обновляет одну строку дважды за команду)
+        records_by_name = {}
+        for filename, count in files:
+            records_by_name[filename] = records_by_name.get(filename, 0) + count
+        
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            # Вторичные (неуникальные) индексы receipts
+            cursor.execute("""
+                SELECT i.relname, pg_get_indexdef(x.indexrelid)
+                FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = 'receipts'::regclass AND NOT x.indisunique
+            """)
+            indexes = cursor.fetchall()
+            for index_name, _ in indexes:
+                cursor.execute(f'DROP INDEX "{index_name}"')
+            
+            self._merge_staged(cursor, 'receipts_staging', distinct=True)
+            
+            # Строки прежних (более длинных) версий загруженных файлов
+            cursor.execute("""
+                DELETE FROM receipts r
+                USING (
+                    SELECT file_name, receipt_date, MAX(line_no) AS max_line_no
+                    FROM receipts_staging
+                    GROUP BY file_name, receipt_date
+                ) s
+                WHERE r.file_name = s.file_name
+                  AND r.receipt_date = s.receipt_date
+                  AND (r.line_no > s.max_line_no OR r.line_no IS NULL)
+            """)
             
-            # Записываем ошибку
-            try:
-                if conn:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        INSERT INTO processed_files 
-                        (file_name, status, error_message)
-                        VALUES (%s, 'error', %s)
-                        ON CONFLICT (file_name) DO UPDATE 
-                        SET processed_at = CURRENT_TIMESTAMP,
-                            status = 'error',
-                            error_message = EXCLUDED.error_message
-                    """, (filename, str(e)[:200]))  # обрезаем длинное сообщение
-                    conn.commit()
-            except Exception as inner_e:
-                logger.error(f"Не удалось записать ошибку: {inner_e}")
+            # Для секционированной таблицы определение индекса содержит ON ONLY,
+            # при пересоздании индекс должен построиться и на секциях
+            for _, index_def in indexes:
+                cursor.execute(index_def.replace(" ON ONLY ", " ON ", 1))
             
+            execute_values(cursor, """
+                INSERT INTO processed_files (file_name, records_count, status)
+                VALUES %s
+                ON CONFLICT (file_name) DO UPDATE 
+                SET processed_at = CURRENT_TIMESTAMP,
+                    status = 'success',
+                    records_count = EXCLUDED.records_count
+            """, [(filename, count, 'success') for filename, count in records_by_name.items()],
+                page_size=BATCH_SIZE)
+            
+            cursor.execute("TRUNCATE receipts_staging")
+            self._commit(conn)
+            logger.info("Массовая загрузка завершена: %s файлов, %s записей",
+                        len(files), sum(records_by_name.values()))
+            return True
+            
+        except Exception as e:
+            logger.error("Ошибка массовой загрузки: %s", e)
+            if conn:
+                self._rollback(conn)
+                # Ошибка переноса относится ко всем подготовленным файлам
+                for filename in records_by_name:
+                    self._record_error(conn, filename, e)
             return False
-        finally:
+    
+    def load_processed_set(self) -> set:
+        """Имена всех успешно обработанных файлов одним запросом"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT file_name FROM processed_files WHERE status = 'success'")
+            processed = {row[0] for row in cursor.fetchall()}
+            conn.commit()  # не держим открытой читающую транзакцию
+            return processed
+        except Exception as e:
+            logger.error("Ошибка чтения обработанных файлов: %s", e)
+            # Соединение общее на весь запуск: не оставляем его в прерванной транзакции
             if conn:
-                conn.close()
+                conn.rollback()
+            return set()
     
     def is_file_processed(self, filename: str) -> bool:
         """Проверка, был ли файл уже обработан"""
         conn = None
         try:
-            conn = self.connect()
+            conn = self.get_connection()
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT 1 FROM processed_files WHERE file_name = %s AND status = 'success'",
                 (filename,)
             )
-            return cursor.fetchone() is not None
+            processed = cursor.fetchone() is not None
+            conn.commit()
+            return processed
         except Exception as e:
-            logger.error(f"Ошибка проверки файла: {e}")
-            return False
-        finally:
+            logger.error("Ошибка проверки файла: %s", e)
             if conn:
-                conn.close()
\ No newline at end of file
+                conn.rollback()
+            return False
\ No newline at end of file
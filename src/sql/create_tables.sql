@@ -1,20 +1,77 @@
 -- Упрощенная схема БД 
 
--- 1. Основная таблица с чеками (все в одной таблице)
+-- 0. Справочники категорий и товаров: receipts хранит их id вместо строк
+-- (заполняются из каталога config.py в init_db.py и новыми значениями при загрузке)
+CREATE TABLE IF NOT EXISTS categories (
+    id SMALLSERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS items (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE,
+    category_id SMALLINT NOT NULL REFERENCES categories(id)
+);
+
+-- 1. Основная таблица с чеками, секционированная по месяцам receipt_date
+-- (секции receipts_YYYY_MM создает ensure_receipts_partition при загрузке;
+-- таблица, созданная ранее без секционирования и справочников, остается как есть:
+-- init_db.py в этом случае останавливается до выполнения файла, см. README)
 CREATE TABLE IF NOT EXISTS receipts (
-    receipt_id SERIAL PRIMARY KEY,
+    receipt_id SERIAL,
     doc_id VARCHAR(50) NOT NULL,
     store_id INTEGER NOT NULL,
     cash_id INTEGER NOT NULL,
-    item VARCHAR(255) NOT NULL,
-    category VARCHAR(100) NOT NULL,
+    item_id INTEGER NOT NULL REFERENCES items(id),
+    category_id SMALLINT NOT NULL REFERENCES categories(id),
     quantity INTEGER NOT NULL CHECK (quantity > 0),
     unit_price DECIMAL(10, 2) NOT NULL CHECK (unit_price >= 0),
     discount_amount DECIMAL(10, 2) DEFAULT 0 CHECK (discount_amount >= 0),
     total_price DECIMAL(12, 2) GENERATED ALWAYS AS (quantity * unit_price - discount_amount) STORED,
     receipt_date DATE NOT NULL,
     file_name VARCHAR(255),
-    loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    line_no INTEGER,
+    loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (receipt_id, receipt_date)
+) PARTITION BY RANGE (receipt_date);
+
+-- Номер строки в файле (для баз, созданных до появления колонки)
+ALTER TABLE receipts ADD COLUMN IF NOT EXISTS line_no INTEGER;
+
+-- Создание месячной секции receipts для даты (если таблица секционирована)
+CREATE OR REPLACE FUNCTION ensure_receipts_partition(p_date DATE) RETURNS void AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_date)::date;
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'receipts'::regclass
+    ) THEN
+        RETURN;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF receipts FOR VALUES FROM (%L) TO (%L)',
+        'receipts_' || to_char(month_start, 'YYYY_MM'),
+        month_start,
+        (month_start + INTERVAL '1 month')::date
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Нежурналируемая промежуточная таблица без индексов для массовой загрузки
+-- (loader.py --bulk: COPY сюда, затем один INSERT ... SELECT в receipts)
+CREATE UNLOGGED TABLE IF NOT EXISTS receipts_staging (
+    doc_id VARCHAR(50),
+    store_id INTEGER,
+    cash_id INTEGER,
+    item VARCHAR(255),
+    category VARCHAR(100),
+    quantity INTEGER,
+    unit_price DECIMAL(10, 2),
+    discount_amount DECIMAL(10, 2),
+    receipt_date DATE,
+    file_name VARCHAR(255),
+    line_no INTEGER
 );
 
 -- 2. Таблица для отслеживания обработанных файлов
@@ -33,9 +90,13 @@ CREATE INDEX IF NOT EXISTS idx_receipts_doc_id ON receipts(doc_id);
 CREATE INDEX IF NOT EXISTS idx_receipts_date ON receipts(receipt_date);
 CREATE INDEX IF NOT EXISTS idx_receipts_store ON receipts(store_id);
 CREATE INDEX IF NOT EXISTS idx_receipts_store_cash ON receipts(store_id, cash_id);
-CREATE INDEX IF NOT EXISTS idx_receipts_category ON receipts(category);
+CREATE INDEX IF NOT EXISTS idx_receipts_category ON receipts(category_id);
 CREATE INDEX IF NOT EXISTS idx_receipts_file ON receipts(file_name);
 CREATE INDEX IF NOT EXISTS idx_processed_files_name ON processed_files(file_name);
+-- Ключ повторной загрузки файла (INSERT ... ON CONFLICT вместо DELETE + INSERT);
+-- включает receipt_date - ключ секционирования (прежний ключ без даты удаляется)
+DROP INDEX IF EXISTS uq_receipts_file_line;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_receipts_file_date_line ON receipts(file_name, receipt_date, line_no);
 
 -- 4. Представление для аналитики
 CREATE OR REPLACE VIEW sales_summary AS
@@ -52,6 +113,29 @@ FROM receipts
 GROUP BY receipt_date, store_id, cash_id
 ORDER BY receipt_date DESC, store_id, cash_id;
 
+-- Чеки с названиями товаров и категорий
+CREATE OR REPLACE VIEW receipts_detailed AS
+SELECT 
+    r.receipt_id,
+    r.doc_id,
+    r.store_id,
+    r.cash_id,
+    i.name AS item,
+    c.name AS category,
+    r.quantity,
+    r.unit_price,
+    r.discount_amount,
+    r.total_price,
+    r.receipt_date,
+    r.file_name,
+    r.loaded_at
+FROM receipts r
+JOIN items i ON i.id = r.item_id
+JOIN categories c ON c.id = r.category_id;
+
 -- Комментарии к таблицам
 COMMENT ON TABLE receipts IS 'Основная таблица с данными о продажах из CSV файлов';
+COMMENT ON TABLE categories IS 'Справочник категорий товаров';
+COMMENT ON TABLE items IS 'Справочник товаров';
+COMMENT ON TABLE receipts_staging IS 'Промежуточная таблица массовой загрузки (UNLOGGED)';
 COMMENT ON TABLE processed_files IS 'Таблица для отслеживания обработанных CSV файлов';
\ No newline at end of file